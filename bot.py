@@ -1,869 +1,1400 @@
-import os
-import sqlite3
-import time
-import datetime
-from dotenv import load_dotenv
-import logging
-from logging.handlers import RotatingFileHandler
-from groq import Groq
-from telegram import Update
-from telegram.ext import Application, MessageHandler, CommandHandler, filters, ContextTypes
-
-# Импортируем информацию о моделях и обработчик голосовых сообщений
-from model_info import (
-    AVAILABLE_MODELS, get_model_info, get_all_models_info,
-    WHISPER_MODEL_INFO, MAX_VOICE_DURATION
-)
-from voice_handler import process_voice_message, WHISPER_MODEL
-
-
-class DatabaseManager:
-    def __init__(self, db_file="bot_data.db"):
-        self.db_file = db_file
-        self._init_db()
-
-    def _init_db(self):
-        """Инициализирует базу данных"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        # Таблица для настроек чатов
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_settings (
-            chat_id INTEGER PRIMARY KEY,
-            model TEXT,
-            temperature REAL,
-            max_tokens INTEGER,
-            active INTEGER,
-            system_prompt TEXT,
-            updated_at TEXT
-        )
-        ''')
-
-        # Таблица для истории сообщений
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS message_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            chat_id INTEGER,
-            role TEXT,
-            content TEXT,
-            created_at TEXT,
-            FOREIGN KEY (chat_id) REFERENCES chat_settings (chat_id)
-        )
-        ''')
-
-        conn.commit()
-        conn.close()
-
-    def get_chat_settings(self, chat_id):
-        """Получает настройки чата из БД или возвращает значения по умолчанию"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM chat_settings WHERE chat_id = ?', (chat_id,))
-        result = cursor.fetchone()
-        conn.close()
-
-        if result:
-            return {
-                "model": result[1],
-                "temperature": result[2],
-                "max_tokens": result[3],
-                "active": bool(result[4]),
-                "system_prompt": result[5]
-            }
-        else:
-            # Значения по умолчанию
-            default_settings = {
-                "model": "deepseek-r1-distill-llama-70b",
-                "temperature": 0.7,
-                "max_tokens": 3000,
-                "active": True,
-                "system_prompt": DEFAULT_SYSTEM_PROMPT
-            }
-            self.save_chat_settings(chat_id, default_settings)
-            return default_settings
-
-    def save_chat_settings(self, chat_id, settings):
-        """Сохраняет настройки чата в БД"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        now = datetime.datetime.now().isoformat()
-
-        cursor.execute('''
-        INSERT OR REPLACE INTO chat_settings 
-        (chat_id, model, temperature, max_tokens, active, system_prompt, updated_at) 
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            chat_id,
-            settings["model"],
-            settings["temperature"],
-            settings["max_tokens"],
-            int(settings["active"]),
-            settings["system_prompt"],
-            now
-        ))
-
-        conn.commit()
-        conn.close()
-
-    def get_message_history(self, chat_id, limit=50):
-        """Получает историю сообщений для чата"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('''
-        SELECT role, content FROM message_history 
-        WHERE chat_id = ? 
-        ORDER BY created_at ASC 
-        LIMIT ?
-        ''', (chat_id, limit))
-
-        results = cursor.fetchall()
-        conn.close()
-
-        return [{"role": role, "content": content} for role, content in results]
-
-    def add_message(self, chat_id, role, content):
-        """Добавляет сообщение в историю"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        now = datetime.datetime.now().isoformat()
-
-        cursor.execute('''
-        INSERT INTO message_history (chat_id, role, content, created_at)
-        VALUES (?, ?, ?, ?)
-        ''', (chat_id, role, content, now))
-
-        conn.commit()
-        conn.close()
-
-    def clear_chat_history(self, chat_id):
-        """Очищает историю сообщений для чата"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM message_history WHERE chat_id = ?', (chat_id,))
-        conn.commit()
-        conn.close()
-
-    def prune_old_messages(self, days=30):
-        """Удаляет сообщения старше указанного количества дней"""
-        conn = sqlite3.connect(self.db_file)
-        cursor = conn.cursor()
-
-        cutoff_date = (datetime.datetime.now() - datetime.timedelta(days=days)).isoformat()
-        cursor.execute('DELETE FROM message_history WHERE created_at < ?', (cutoff_date,))
-
-        deleted_count = cursor.rowcount
-        conn.commit()
-        conn.close()
-
-        return deleted_count
-
-
-# Настройка логирования с ротацией файлов
-log_handler = RotatingFileHandler(
-    'bot.log',
-    maxBytes=10*1024*1024,  # 10 MB
-    backupCount=5,  # Хранить 5 архивных файлов
-    encoding='utf-8'
-)
-
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        log_handler,
-        logging.StreamHandler()  # Вывод в консоль
-    ]
-)
-logger = logging.getLogger(__name__)
-
-# Загрузка переменных из .env
-load_dotenv()
-GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
-
-# Проверка, что ключи загружены
-if not GROQ_API_KEY or not TELEGRAM_TOKEN:
-    logger.error("Не удалось загрузить GROQ_API_KEY или TELEGRAM_TOKEN из .env")
-    raise ValueError("Необходимо указать GROQ_API_KEY и TELEGRAM_TOKEN в файле .env")
-
-# Инициализация клиента Groq
-client = Groq(api_key=GROQ_API_KEY)
-
-# Инициализация базы данных
-db = DatabaseManager()
-
-MAX_HISTORY = 50  # Максимальное количество сообщений в истории
-
-# Системный промпт по умолчанию
-DEFAULT_SYSTEM_PROMPT = """Ты - полезный и дружелюбный ассистент в групповом чате Telegram.
-Твоя задача - помогать участникам чата, отвечать на их вопросы и поддерживать беседу.
-Старайся давать краткие, но информативные ответы.
-Помни, что тебя упоминают по имени, поэтому в ответах не надо обращаться к конкретному пользователю.
-Отвечай на русском языке, если не просят иное.
-Не используй эмодзи слишком часто.
-"""
-
-
-async def cleanup_old_data(context: ContextTypes.DEFAULT_TYPE):
-    """Периодическая очистка старых данных"""
-    # Очистка старых сообщений (старше 30 дней)
-    deleted_count = db.prune_old_messages(days=30)
-    logger.info(f"Очищено {deleted_count} старых сообщений из базы данных")
-
-
-def process_model_response(text):
-    """Обрабатывает ответ модели, удаляя теги <think> и их содержимое"""
-    # Удаляем всё содержимое между тегами <think> и </think>, включая сами теги
-    import re
-    clean_text = re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
-    return clean_text.strip()
-
-
-async def send_long_message(update, text, parse_mode=None):
-    """Разбивает длинное сообщение на части с учетом целостности параграфов"""
-    MAX_LENGTH = 4000  # Чуть меньше лимита Telegram для безопасности
-
-    if len(text) <= MAX_LENGTH:
-        try:
-            return await update.message.reply_text(text, parse_mode=parse_mode)
-        except Exception as e:
-            logger.error(f"Ошибка при отправке сообщения с форматированием: {e}")
-            # Пробуем отправить без форматирования
-            return await update.message.reply_text(text)
-
-    # Разбиваем по абзацам для более естественного деления
-    paragraphs = text.split('\n\n')
-    current_part = ""
-
-    for paragraph in paragraphs:
-        # Если добавление абзаца превысит лимит, отправляем текущую часть
-        if len(current_part + paragraph + '\n\n') > MAX_LENGTH:
-            if current_part:
-                try:
-                    await update.message.reply_text(current_part, parse_mode=parse_mode)
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке части сообщения: {e}")
-                    # Пробуем отправить без форматирования
-                    await update.message.reply_text(current_part)
-                current_part = paragraph + '\n\n'
-            else:
-                # Если один абзац слишком большой, разбиваем его на части
-                for i in range(0, len(paragraph), MAX_LENGTH):
-                    chunk = paragraph[i:i + MAX_LENGTH]
-                    try:
-                        await update.message.reply_text(chunk, parse_mode=parse_mode)
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке фрагмента абзаца: {e}")
-                        await update.message.reply_text(chunk)
-        else:
-            current_part += paragraph + '\n\n'
-
-    # Отправляем оставшуюся часть, если она есть
-    if current_part:
-        try:
-            await update.message.reply_text(current_part, parse_mode=parse_mode)
-        except Exception as e:
-            logger.error(f"Ошибка при отправке последней части: {e}")
-            await update.message.reply_text(current_part)
-
-
-async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
-    """Проверяет, является ли пользователь администратором группы"""
-    user_id = update.effective_user.id
-    chat_id = update.effective_chat.id
-
-    try:
-        # Получаем информацию о пользователях с правами администратора в чате
-        chat_admins = await context.bot.get_chat_administrators(chat_id)
-        admin_ids = [admin.user.id for admin in chat_admins]
-
-        # Проверяем, есть ли ID пользователя в списке ID администраторов
-        is_user_admin = user_id in admin_ids
-
-        logger.info(f"Проверка прав администратора для пользователя {user_id} в чате {chat_id}: {is_user_admin}")
-        return is_user_admin
-    except Exception as e:
-        logger.error(f"Ошибка при проверке прав администратора: {str(e)}")
-        # В случае ошибки считаем, что пользователь не администратор
-        return False
-
-
-async def admin_required(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет сообщение о необходимости прав администратора"""
-    await update.message.reply_text(
-        "⚠️ Для использования этой команды необходимы права администратора группы."
-    )
-
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start"""
-    await update.message.reply_text(
-        f"Привет! Я бот на базе Groq API. Я буду отвечать на сообщения, в которых меня упоминают через @{context.bot.username}.\n"
-        "Используйте /help для получения списка команд и /models для информации о доступных моделях."
-    )
-
-
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /help"""
-    is_user_admin = await is_admin(update, context)
-
-    basic_commands = (
-        "Доступные команды:\n"
-        "/start - Запустить бота\n"
-        "/help - Показать это сообщение\n"
-        "/explain - Руководство по использованию бота\n"
-        "/models - Информация о доступных моделях\n\n"
-        f"Вы можете обращаться к боту, упоминая его через @{context.bot.username} в сообщении"
-    )
-
-    admin_commands = (
-        "\n\n<b>Команды только для администраторов:</b>\n"
-        "/settings - Показать текущие настройки\n"
-        "/set_model [модель] - Установить модель (llama3-70b-8192, llama3-8b-8192 и др.)\n"
-        "/set_temp [0.0-1.0] - Установить температуру генерации\n"
-        "/set_max_tokens [число] - Установить максимальное количество токенов ответа\n"
-        "/toggle - Включить/выключить бота в этом чате\n"
-        "/clear_history - Очистить историю чата\n"
-    )
-
-    # Если пользователь админ, показываем все команды
-    if is_user_admin:
-        help_text = basic_commands + admin_commands
-        await update.message.reply_text(help_text, parse_mode="HTML")
-    else:
-        # Обычным пользователям показываем только базовые команды
-        await update.message.reply_text(basic_commands)
-
-
-async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать текущие настройки чата"""
-    # Проверяем, является ли пользователь администратором
-    if not await is_admin(update, context):
-        await admin_required(update, context)
-        return
-
-    chat_id = update.effective_chat.id
-    settings = db.get_chat_settings(chat_id)
-
-    # Получаем информацию о модели
-    model_info = get_model_info(settings['model'])
-
-    history_count = len(db.get_message_history(chat_id))
-
-    settings_text = (
-        f"<b>Текущие настройки:</b>\n"
-        f"• Модель: <b>{settings['model']}</b>\n"
-        f"• Температура: <b>{settings['temperature']}</b>\n"
-        f"• Максимальная длина ответа: <b>{settings['max_tokens']} токенов</b>\n"
-        f"• Бот: <b>{'активен' if settings['active'] else 'неактивен'}</b>\n"
-        f"• Количество сообщений в истории: <b>{history_count}/{MAX_HISTORY}</b>\n\n"
-        f"<b>Информация о текущей модели:</b>\n"
-        f"• {model_info['description']}\n"
-        f"• Рекомендуется для: {model_info['use_case']}\n"
-        f"• Лимиты: {model_info['limits']}\n"
-    )
-
-    await update.message.reply_text(settings_text, parse_mode="HTML")
-
-
-async def set_max_tokens(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Установить максимальное количество токенов ответа"""
-    # Проверяем, является ли пользователь администратором
-    if not await is_admin(update, context):
-        await admin_required(update, context)
-        return
-
-    chat_id = update.effective_chat.id
-
-    if not context.args:
-        await update.message.reply_text("Пожалуйста, укажите максимальное количество токенов (например, 2000)")
-        return
-
-    try:
-        max_tokens = int(context.args[0])
-        if max_tokens > 0:
-            settings = db.get_chat_settings(chat_id)
-            settings["max_tokens"] = max_tokens
-            db.save_chat_settings(chat_id, settings)
-            await update.message.reply_text(
-                f"Максимальное количество токенов установлено: <b>{max_tokens}</b>\n\n"
-                f"Это влияет на максимальную длину ответа бота. Чем больше значение, тем длиннее ответы может давать бот.",
-                parse_mode="HTML"
-            )
-        else:
-            await update.message.reply_text("Количество токенов должно быть положительным числом")
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, укажите корректное целое число")
-
-
-async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Установить модель для использования"""
-    # Проверяем, является ли пользователь администратором
-    if not await is_admin(update, context):
-        await admin_required(update, context)
-        return
-
-    chat_id = update.effective_chat.id
-
-    if not context.args:
-        await update.message.reply_text(
-            f"Пожалуйста, укажите модель. Например: /set_model llama3-70b-8192\n"
-            f"Для просмотра доступных моделей используйте /models"
-        )
-        return
-
-    model = context.args[0]
-
-    if model not in AVAILABLE_MODELS:
-        await update.message.reply_text(
-            f"Недопустимая модель. Доступные модели: {', '.join(AVAILABLE_MODELS)}\n"
-            f"Для подробной информации используйте /models"
-        )
-        return
-
-    # Получаем информацию о модели
-    model_info = get_model_info(model)
-
-    # Устанавливаем модель
-    settings = db.get_chat_settings(chat_id)
-    settings["model"] = model
-    db.save_chat_settings(chat_id, settings)
-
-    await update.message.reply_text(
-        f"✅ Модель установлена: <b>{model}</b>\n\n"
-        f"<b>Информация о модели:</b>\n"
-        f"• {model_info['description']}\n"
-        f"• Рекомендуется для: {model_info['use_case']}\n"
-        f"• Лимиты: {model_info['limits']}\n"
-        f"• Особенности: {model_info['features']}",
-        parse_mode="HTML"
-    )
-
-
-async def set_temperature(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Установить температуру генерации"""
-    # Проверяем, является ли пользователь администратором
-    if not await is_admin(update, context):
-        await admin_required(update, context)
-        return
-
-    chat_id = update.effective_chat.id
-
-    if not context.args:
-        await update.message.reply_text("Пожалуйста, укажите температуру (от 0.0 до 1.0)")
-        return
-
-    try:
-        temp = float(context.args[0])
-        if 0.0 <= temp <= 1.0:
-            settings = db.get_chat_settings(chat_id)
-            settings["temperature"] = temp
-            db.save_chat_settings(chat_id, settings)
-            await update.message.reply_text(
-                f"Температура установлена: <b>{temp}</b>\n\n"
-                f"<b>Что это значит:</b>\n"
-                f"• <b>Низкая (0.1-0.3)</b>: более предсказуемые, точные ответы. Хорошо для фактических вопросов и кодирования.\n"
-                f"• <b>Средняя (0.4-0.7)</b>: баланс между точностью и разнообразием. Подходит для большинства задач.\n"
-                f"• <b>Высокая (0.8-1.0)</b>: более креативные, разнообразные ответы. Подходит для творческих задач.",
-                parse_mode="HTML"
-            )
-        else:
-            await update.message.reply_text("Температура должна быть от 0.0 до 1.0")
-    except ValueError:
-        await update.message.reply_text("Пожалуйста, укажите корректное число")
-
-
-async def toggle_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Включить/выключить бота в чате"""
-    # Проверяем, является ли пользователь администратором
-    if not await is_admin(update, context):
-        await admin_required(update, context)
-        return
-
-    chat_id = update.effective_chat.id
-    settings = db.get_chat_settings(chat_id)
-    settings["active"] = not settings["active"]
-    db.save_chat_settings(chat_id, settings)
-    status = "активен" if settings["active"] else "неактивен"
-    await update.message.reply_text(f"Бот теперь {status} в этом чате")
-
-
-async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Очистить историю чата"""
-    # Проверяем, является ли пользователь администратором
-    if not await is_admin(update, context):
-        await admin_required(update, context)
-        return
-
-    chat_id = update.effective_chat.id
-    db.clear_chat_history(chat_id)
-    await update.message.reply_text("История чата очищена")
-
-
-async def models_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Показать информацию о доступных моделях"""
-    models_info = get_all_models_info()
-
-    report = "<b>Доступные модели:</b>\n\n"
-
-    for model_info in models_info:
-        model_name = model_info['name']
-
-        report += (
-            f"<b>{model_name}</b>\n"
-            f"• {model_info['description']}\n"
-            f"• <b>Когда использовать:</b> {model_info['use_case']}\n"
-            f"• <b>Особенности:</b> {model_info['features']}\n"
-            f"• <b>Лимиты:</b> {model_info['limits']}\n\n"
-        )
-
-    # Добавляем информацию о модели для распознавания голосовых сообщений
-    report += (
-        f"<b>Модель для голосовых сообщений: {WHISPER_MODEL}</b>\n"
-        f"• {WHISPER_MODEL_INFO['description']}\n"
-        f"• <b>Лимиты:</b> {WHISPER_MODEL_INFO['limits']}\n"
-        f"• <b>Особенности:</b> {WHISPER_MODEL_INFO['features']}\n\n"
-    )
-
-    report += "Для установки модели используйте команду /set_model [название_модели]"
-
-    try:
-        await update.message.reply_text(report, parse_mode="HTML")
-    except Exception as e:
-        # В случае ошибки форматирования отправляем без HTML
-        logger.error(f"Ошибка при отправке информации о моделях: {str(e)}")
-        await update.message.reply_text(report.replace("<b>", "").replace("</b>", ""))
-
-
-async def explain_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
-
-    """Объяснить все параметры настройки бота"""
-    chat_id = update.effective_chat.id
-    settings = db.get_chat_settings(chat_id)
-    is_user_admin = await is_admin(update, context)
-    history_count = len(db.get_message_history(chat_id))
-
-    # Базовая информация для всех пользователей
-    basic_explanation = (
-        "📋 <b>Руководство по использованию бота</b>\n\n"
-
-        "<b>Как взаимодействовать с ботом:</b>\n"
-        f"• Упомянуть бота: @{context.bot.username} [ваш вопрос]\n"
-        "• Отправить голосовое сообщение, упомянув бота в подписи или ответив на его сообщение\n\n"
-    )
-
-    basic_explanation += (
-        "<b>Примеры использования:</b>\n"
-        f"• @{context.bot.username} расскажи о квантовой физике\n"
-        f"• @{context.bot.username} реши задачу: 2x + 5 = 15\n"
-        f"• @{context.bot.username} напиши пример кода на Python для парсинга JSON\n\n"
-
-        "<b>Типы моделей:</b>\n"
-        "• Большие модели (llama3-70b-8192) - для сложных задач\n"
-        "• Средние модели (mistral-saba-24b) - универсальные\n"
-        "• Компактные модели (llama3-8b-8192, gemma-7b-it) - для простых запросов\n\n"
-
-        "Используйте команду /models для подробной информации о каждой модели"
-    )
-
-    # Информация по настройкам только для администраторов
-    admin_explanation = ""
-    if is_user_admin:
-        admin_explanation = (
-            "\n\n<b>Настройка бота (только для администраторов):</b>\n"
-
-            "<b>Модель ИИ</b>\n"
-            "Команда: /set_model [модель]\n"
-            f"Текущая модель: <b>{settings['model']}</b>\n\n"
-
-            "<b>Температура</b>\n"
-            "Команда: /set_temp [значение от 0.0 до 1.0]\n"
-            "• <b>Низкая (0.1-0.3)</b>: более предсказуемые, точные ответы. Хорошо для фактических вопросов и кодирования.\n"
-            "• <b>Средняя (0.4-0.7)</b>: баланс между точностью и разнообразием. Подходит для большинства задач.\n"
-            "• <b>Высокая (0.8-1.0)</b>: более случайные, творческие ответы. Подходит для креативных задач, генерации идей.\n"
-            f"Текущая температура: <b>{settings['temperature']}</b>\n\n"
-            
-            "<b>Максимальное количество токенов</b>\n"
-            "Команда: /set_max_tokens [число]\n"
-            "• Определяет максимальную длину ответа бота\n"
-            "• Чем выше значение, тем длиннее может быть ответ\n"
-            "• Рекомендуемые значения: 1000-4000\n"
-            f"Текущее значение: <b>{settings['max_tokens']}</b>\n\n"
-            
-            "<b>История сообщений</b>\n"
-            "Команда для очистки: /clear_history\n"
-            "• Бот запоминает историю диалога, что позволяет давать более контекстные ответы.\n"
-            "• Очистка истории полезна при смене темы или для экономии токенов.\n"
-            f"Текущее количество сообщений в истории: <b>{history_count}/{MAX_HISTORY}</b>\n\n"
-
-            "<b>Активация/деактивация</b>\n"
-            "Команда: /toggle\n"
-            "• Включает или выключает бота в данном чате.\n"
-            f"Текущий статус: <b>{'Активен' if settings['active'] else 'Неактивен'}</b>\n\n"
-
-            "<b>🔍 Рекомендуемые настройки:</b>\n"
-            "• Для общего использования: llama3-70b-8192, температура 0.7\n"
-            "• Для точных ответов и фактов: llama3-70b-8192, температура 0.2\n"
-            "• Для креативных задач: llama3-70b-8192, температура 0.9\n"
-            "• Для быстрых ответов на простые вопросы: llama3-8b-8192, температура 0.5\n"
-        )
-
-    explanation = basic_explanation + admin_explanation
-
-    try:
-        await update.message.reply_text(explanation, parse_mode="HTML")
-        logger.info(f"Отправлено руководство по настройкам в чат {chat_id}")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке руководства: {str(e)}")
-        # Запасной вариант без HTML-форматирования
-        plain_explanation = explanation.replace("<b>", "").replace("</b>", "")
-        await update.message.reply_text(plain_explanation)
-        logger.info(f"Отправлена версия руководства без форматирования в чат {chat_id}")
-
-
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка входящих сообщений"""
-    if update.message.chat.type in ["group", "supergroup"]:
-        chat_id = update.message.chat.id
-        username = update.message.from_user.username or update.message.from_user.first_name or "Unknown"
-
-        # Проверяем, активен ли бот в этом чате
-        settings = db.get_chat_settings(chat_id)
-        if not settings["active"]:
-            logger.info(f"Бот неактивен в чате {chat_id}, игнорирую сообщение")
-            return
-
-        # Обработка голосовых сообщений
-        if update.message.voice:
-            logger.info(f"Получено голосовое сообщение от @{username} в чате {chat_id}")
-
-            # Получаем транскрипцию голосового сообщения
-            transcribed_text = await process_voice_message(update, context, client)
-
-            # Если не удалось получить текст, прекращаем обработку
-            if not transcribed_text:
-                logger.warning("Не удалось получить текст голосового сообщения")
-                return
-
-            # Устанавливаем транскрибированный текст как сообщение для обработки
-            user_message = transcribed_text
-            logger.info(f"Транскрипция голосового сообщения: {user_message}")
-        else:
-            # Обработка текстовых сообщений
-            user_message = update.message.text
-
-            # Получаем имя пользователя бота
-            bot_username = context.bot.username
-            logger.info(f"Проверка упоминания бота @{bot_username} в сообщении: {user_message}")
-
-            # Проверяем, есть ли упоминание бота в сообщении
-            is_bot_mentioned = False
-            clean_message = user_message
-
-            # Проверяем по entities
-            if update.message.entities:
-                for entity in update.message.entities:
-                    if entity.type == 'mention':
-                        mention = user_message[entity.offset:entity.offset + entity.length]
-                        logger.info(f"Найдено упоминание: {mention}")
-                        if mention.lower() == f"@{bot_username.lower()}":
-                            is_bot_mentioned = True
-                            # Удаляем упоминание из сообщения
-                            clean_message = user_message.replace(mention, "").strip()
-                            logger.info(f"Найдено упоминание бота: {mention}, сообщение после очистки: {clean_message}")
-                            break
-
-            # Также проверяем простым текстовым поиском (как запасной вариант)
-            if not is_bot_mentioned and f"@{bot_username}" in user_message:
-                is_bot_mentioned = True
-                clean_message = user_message.replace(f"@{bot_username}", "").strip()
-                logger.info(f"Найдено текстовое упоминание бота, сообщение после очистки: {clean_message}")
-
-            # Также проверяем, является ли сообщение ответом на сообщение бота
-            if not is_bot_mentioned and update.message.reply_to_message:
-                if update.message.reply_to_message.from_user.id == context.bot.id:
-                    is_bot_mentioned = True
-                    clean_message = user_message
-                    logger.info(f"Сообщение является ответом на сообщение бота")
-
-            # Если бот не упомянут, игнорируем сообщение
-            if not is_bot_mentioned:
-                logger.info(f"Бот не упомянут в сообщении, игнорирую")
-                return
-
-            # Если после удаления упоминания сообщение пустое
-            if not clean_message:
-                logger.info("Сообщение содержит только упоминание бота, отправляю приветствие")
-                await update.message.reply_text("Здравствуйте! Чем я могу вам помочь?")
-                return
-
-            user_message = clean_message
-
-        logger.info(f"Обрабатываю сообщение от @{username} в чате {chat_id}: {user_message}")
-
-        try:
-            settings = db.get_chat_settings(chat_id)
-            messages = [{"role": "system", "content": settings["system_prompt"]}]
-            messages.extend(db.get_message_history(chat_id))
-
-            # Добавляем текущее сообщение
-            messages.append({"role": "user", "content": f"{username}: {user_message}"})
-
-            # Получаем модель для использования
-            model = settings["model"]
-
-            # Логируем детали запроса для отладки
-            logger.info(f"Модель: {model}")
-            logger.info(f"Температура: {settings['temperature']}")
-            logger.info(f"Макс. токенов: {settings['max_tokens']}")
-            messages_history = db.get_message_history(chat_id)
-            logger.info(f"Кол-во сообщений в истории: {len(messages_history)}")
-
-            # Отправляем индикатор набора текста
-            await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-
-            # Запрос к Groq
-            logger.info("Отправка запроса к API Groq...")
-            start_time = time.time()
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=settings["max_tokens"],
-                temperature=settings["temperature"]
-            )
-            elapsed_time = time.time() - start_time
-            logger.info(f"Ответ от Groq получен за {elapsed_time:.2f} секунд")
-
-            reply_text = response.choices[0].message.content
-
-            # Добавляем сообщение пользователя и ответ бота в историю
-            db.add_message(chat_id, "user", f"{username}: {user_message}")
-            db.add_message(chat_id, "assistant", reply_text)
-
-            # Логируем успешный ответ
-            logger.info(f"Отправлен ответ в чат {chat_id}: {reply_text[:50]}...")
-
-            # Очищаем ответ от тегов <think>
-            cleaned_reply = process_model_response(reply_text)
-
-            # Отправляем ответ, разбивая на части при необходимости
-            await send_long_message(update, cleaned_reply, parse_mode="Markdown")
-
-        except Exception as e:
-            # Расширенное логирование ошибки
-            logger.error(f"Ошибка при обработке запроса в чате {chat_id}: {str(e)}")
-            logger.error(f"Тип ошибки: {type(e).__name__}")
-
-            # Проверяем, связана ли ошибка с моделью
-            if "model" in str(e).lower() and "decommissioned" in str(e).lower():
-                logger.error("Обнаружена ошибка с моделью! Возможно, модель устарела или не поддерживается.")
-                await update.message.reply_text(
-                    f"Модель {settings['model']} недоступна или устарела. "
-                    f"Переключаюсь на llama3-70b-8192."
-                )
-                settings['model'] = "llama3-70b-8192"
-            elif "rate limit" in str(e).lower() or "quota" in str(e).lower():
-                logger.error("Достигнут лимит запросов API")
-
-                # Формируем сообщение с рекомендациями по модели
-                error_msg = (
-                    "⚠️ <b>Достигнут лимит запросов для модели</b> "
-                    f"<b>{settings['model']}</b>\n\n"
-                    "Рекомендации:\n"
-                    "1. Попробуйте использовать другую модель, например:\n"
-                    "• /set_model deepseek-r1-distill-llama-70b (модель без дневного лимита токенов)\n"
-                    "• /set_model llama3-8b-8192 (более легкая модель)\n\n"
-                    "2. Подождите некоторое время - лимиты обновляются ежедневно\n\n"
-                    "Используйте команду /models для просмотра всех доступных моделей и их лимитов."
-                )
-
-                try:
-                    await update.message.reply_text(error_msg, parse_mode="HTML")
-                except:
-                    # Если с HTML возникла проблема, отправляем без форматирования
-                    await update.message.reply_text(error_msg.replace("<b>", "").replace("</b>", ""))
-            else:
-                # Общее сообщение об ошибке
-                await update.message.reply_text(
-                    "Произошла ошибка, попробуйте позже или используйте другую модель (/models для просмотра доступных моделей).")
-
-
-# Функция для обработки голосовых сообщений
-async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработка голосовых сообщений"""
-    # Вызываем общий обработчик сообщений, который определит голосовое сообщение
-    await handle_message(update, context)
-
-
-# Функция для мониторинга состояния
-async def log_status(context: ContextTypes.DEFAULT_TYPE):
-    """Периодическое логирование состояния бота"""
-    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    conn = sqlite3.connect(db.db_file)
-    cursor = conn.cursor()
-    cursor.execute("SELECT COUNT(DISTINCT chat_id) FROM chat_settings")
-    total_chats = cursor.fetchone()[0]
-    cursor.execute("SELECT COUNT(*) FROM message_history")
-    total_messages = cursor.fetchone()[0]
-    cursor.execute("SELECT chat_id, model FROM chat_settings")
-    chat_models = cursor.fetchall()
-    conn.close()
-
-    logger.info(f"=== СТАТУС БОТА [{now}] ===")
-    logger.info(f"Активных чатов: {total_chats}")
-    logger.info(f"Всего сообщений в БД: {total_messages}")
-    logger.info(f"Настройки чатов: {', '.join([f'Чат {cid}: {model}' for cid, model in chat_models])}")
-    logger.info("=== КОНЕЦ СТАТУСА ===")
-
-
-# Запуск бота
-if __name__ == "__main__":
-    logger.info("=========================================")
-    logger.info("Запуск бота...")
-    logger.info(f"Время запуска: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    logger.info(f"Используемый API: Groq")
-    logger.info(f"Настройки логирования: уровень {logging.getLevelName(logger.level)}")
-    logger.info("=========================================")
-
-    app = Application.builder().token(TELEGRAM_TOKEN).build()
-
-    # Добавляем обработчики команд
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("settings", settings))
-    app.add_handler(CommandHandler("set_model", set_model))
-    app.add_handler(CommandHandler("set_temp", set_temperature))
-    app.add_handler(CommandHandler("set_max_tokens", set_max_tokens))
-    app.add_handler(CommandHandler("toggle", toggle_bot))
-    app.add_handler(CommandHandler("clear_history", clear_history))
-    app.add_handler(CommandHandler("explain", explain_settings))
-    app.add_handler(CommandHandler("models", models_command))
-
-    # Обработчик для текстовых сообщений
-    app.add_handler(MessageHandler(
-        filters.TEXT & ~filters.COMMAND,
-        handle_message
-    ))
-
-    # Обработчик для голосовых сообщений
-    app.add_handler(MessageHandler(
-        filters.VOICE,
-        handle_voice
-    ))
-
-    # Добавляем периодическую задачу для логирования состояния
-    job_queue = app.job_queue
-    job_queue.run_repeating(log_status, interval=3600, first=10)  # Логирование каждый час
-    #Очистка базы данных
-    job_queue.run_daily(cleanup_old_data, time=datetime.time(hour=3, minute=0))  # Запуск ежедневно в 3:00
-
-    logger.info("Бот готов к работе, начинаю прослушивание...")
-
-    # Запуск бота
-    app.run_polling()
-
-    logger.info("=========================================")
-    logger.info("Бот остановлен.")
-    logger.info(f"Время остановки: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+import os
+import re
+import queue
+import atexit
+import asyncio
+import hashlib
+import random
+import time
+import datetime
+import aiosqlite
+from collections import OrderedDict, defaultdict, deque
+from dotenv import load_dotenv
+import logging
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+import httpx
+from groq import APIConnectionError, InternalServerError, RateLimitError
+from telegram import Update
+from telegram.ext import Application, MessageHandler, CommandHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
+
+# Импортируем информацию о моделях и обработчик голосовых сообщений
+from model_info import (
+    AVAILABLE_MODELS, get_model_info, get_all_models_info,
+    WHISPER_MODEL_INFO, MAX_VOICE_DURATION
+)
+from voice_handler import process_voice_message, WHISPER_MODEL
+from groq_batcher import GroqBatcher
+from groq_pool import GroqClientPool
+from groq_limiter import GroqTokenBucket, budget_trim, estimate_tokens, MODEL_TPM, DEFAULT_TPM
+
+
+# Тексты SQL-запросов как константы модуля: SQLite кэширует подготовленные
+# выражения по тексту запроса, поэтому повторное использование одной и той же
+# строки позволяет переиспользовать уже скомпилированный sqlite3_stmt
+# вместо повторного разбора SQL на каждый вызов
+# Явный список колонок: SQLite не копирует ненужный updated_at,
+# а порядок полей не зависит от схемы таблицы.
+# Один запрос вместо SELECT + INSERT + COMMIT: для нового чата вставляются
+# значения по умолчанию, для существующего возвращается его строка
+# (RETURNING требует SQLite >= 3.35)
+_SQL_GET_OR_CREATE_SETTINGS = '''
+INSERT INTO chat_settings
+(chat_id, model, temperature, max_tokens, active, system_prompt, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(chat_id) DO UPDATE SET chat_id = chat_id
+RETURNING model, temperature, max_tokens, active, system_prompt
+'''
+
+_SQL_UPSERT_SETTINGS = '''
+INSERT OR REPLACE INTO chat_settings
+(chat_id, model, temperature, max_tokens, active, system_prompt, updated_at)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+_SQL_GET_HIST = '''
+SELECT role, content, username FROM message_history
+WHERE chat_id = ?
+ORDER BY created_at_i ASC
+LIMIT ?
+'''
+
+_SQL_ADD_MSG = '''
+INSERT INTO message_history (chat_id, role, content, username, created_at_i)
+VALUES (?, ?, ?, ?, ?)
+'''
+
+_SQL_CLEAR_HIST = 'DELETE FROM message_history WHERE chat_id = ?'
+
+_SQL_COUNT_MSGS = 'SELECT COUNT(*) FROM message_history WHERE chat_id = ?'
+
+_SQL_PRUNE = 'DELETE FROM message_history WHERE created_at_i < ?'
+
+# Максимальный размер LRU-кэша настроек чатов
+_SETTINGS_CACHE_MAX = 1024
+
+# Параметры фонового писателя истории: размер пачки и окно накопления
+_WRITE_MAX_BATCH = 50
+_WRITE_FLUSH_MS = 200
+
+
+class DatabaseManager:
+    def __init__(self, db_file="bot_data.db"):
+        self.db_file = db_file
+        self._conn = None
+        # LRU-кэш настроек чатов: одна и та же строка читается на каждое
+        # сообщение в чате, поэтому горячий путь обслуживается из памяти
+        self._settings_cache = OrderedDict()
+        # Кэш истории сообщений: deque с maxlen=MAX_HISTORY на каждый чат,
+        # запись идёт сквозным образом (и в память, и в SQLite)
+        self._history = {}
+        # Очередь отложенной записи истории и фоновая задача-писатель
+        self._write_queue = asyncio.Queue()
+        self._writer = None
+
+    async def init(self):
+        """Открывает соединение и инициализирует базу данных"""
+        # Одно долгоживущее асинхронное соединение вместо открытия/закрытия
+        # на каждый запрос: страничный кэш SQLite сохраняется между запросами,
+        # а сами запросы выполняются в фоновом потоке aiosqlite
+        # и не блокируют event loop.
+        self._conn = await aiosqlite.connect(
+            self.db_file, isolation_level=None, cached_statements=256
+        )
+        conn = self._conn
+
+        # Настройки производительности: WAL снижает стоимость fsync,
+        # остальные PRAGMA уменьшают обращения к диску.
+        # auto_vacuum действует только для новых файлов БД и позволяет
+        # периодически возвращать освобождённые страницы через
+        # incremental_vacuum вместо полного VACUUM
+        await conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        await conn.execute('PRAGMA journal_mode=WAL')
+        await conn.execute('PRAGMA synchronous=NORMAL')
+        await conn.execute('PRAGMA temp_store=MEMORY')
+        await conn.execute('PRAGMA cache_size=-64000')
+        await conn.execute('PRAGMA mmap_size=268435456')
+
+        # Таблица для настроек чатов
+        await conn.execute('''
+        CREATE TABLE IF NOT EXISTS chat_settings (
+            chat_id INTEGER PRIMARY KEY,
+            model TEXT,
+            temperature REAL,
+            max_tokens INTEGER,
+            active INTEGER,
+            system_prompt TEXT,
+            updated_at TEXT
+        )
+        ''')
+
+        # Таблица для истории сообщений
+        await conn.execute('''
+        CREATE TABLE IF NOT EXISTS message_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            role TEXT,
+            content TEXT,
+            created_at TEXT,
+            FOREIGN KEY (chat_id) REFERENCES chat_settings (chat_id)
+        )
+        ''')
+
+        # Миграция: целочисленная метка времени (unix-время в миллисекундах)
+        # вместо ISO-строки, чтобы выборка истории и очистка шли по индексу
+        # с целочисленным сравнением вместо сравнения 26-байтовых строк
+        async with conn.execute('PRAGMA table_info(message_history)') as cursor:
+            columns = [row[1] for row in await cursor.fetchall()]
+
+        # Имя пользователя хранится отдельной колонкой и подставляется
+        # в текст только при сборке промпта: история не тащит лишние
+        # токены в каждый последующий запрос
+        if 'username' not in columns:
+            await conn.execute('ALTER TABLE message_history ADD COLUMN username TEXT')
+
+        if 'created_at_i' not in columns:
+            await conn.execute('ALTER TABLE message_history ADD COLUMN created_at_i INTEGER')
+            await conn.execute('''
+            UPDATE message_history
+            SET created_at_i = CAST(strftime('%s', created_at) AS INTEGER) * 1000
+            WHERE created_at IS NOT NULL
+            ''')
+
+        # Составной индекс превращает выборку истории чата и очистку
+        # старых сообщений в диапазонный поиск по B-дереву
+        await conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_msg_chat_time
+        ON message_history(chat_id, created_at_i)
+        ''')
+
+        # Фоновый писатель: вставки истории уходят с пути обработки
+        # сообщения и коммитятся пачками
+        self._writer = asyncio.get_running_loop().create_task(self._writer_loop())
+
+    async def close(self):
+        """Дописывает очередь истории и закрывает соединение с БД"""
+        if self._writer is not None:
+            # Сентинел: писатель дописывает накопленное и завершается
+            await self._write_queue.put(None)
+            await self._writer
+            self._writer = None
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    def _cache_settings(self, chat_id, settings):
+        """Кладёт настройки чата в LRU-кэш, вытесняя самую старую запись"""
+        cache = self._settings_cache
+        cache[chat_id] = dict(settings)
+        cache.move_to_end(chat_id)
+        if len(cache) > _SETTINGS_CACHE_MAX:
+            cache.popitem(last=False)
+
+    async def get_chat_settings(self, chat_id):
+        """Получает настройки чата из кэша или БД, либо значения по умолчанию"""
+        cache = self._settings_cache
+        if chat_id in cache:
+            cache.move_to_end(chat_id)
+            # Копия, чтобы изменения у вызывающего не попадали в кэш мимо save
+            return dict(cache[chat_id])
+
+        # Значения по умолчанию вставляются только для нового чата;
+        # для существующего запрос возвращает сохранённую строку
+        params = (
+            chat_id,
+            "deepseek-r1-distill-llama-70b",
+            0.7,
+            3000,
+            1,
+            DEFAULT_SYSTEM_PROMPT,
+            int(time.time())
+        )
+        async with self._conn.execute(_SQL_GET_OR_CREATE_SETTINGS, params) as cursor:
+            result = await cursor.fetchone()
+
+        model, temperature, max_tokens, active, system_prompt = result
+        settings = {
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "active": bool(active),
+            "system_prompt": system_prompt
+        }
+        self._cache_settings(chat_id, settings)
+        return settings
+
+    async def save_chat_settings(self, chat_id, settings):
+        """Сохраняет настройки чата в БД"""
+        # Целочисленное unix-время: без аллокации datetime и формата ISO
+        now = int(time.time())
+
+        params = (
+            chat_id,
+            settings["model"],
+            settings["temperature"],
+            settings["max_tokens"],
+            int(settings["active"]),
+            settings["system_prompt"],
+            now
+        )
+        await self._conn.execute(_SQL_UPSERT_SETTINGS, params)
+        self._cache_settings(chat_id, settings)
+
+    async def get_message_history(self, chat_id, limit=50):
+        """Получает историю сообщений для чата"""
+        history = self._history.get(chat_id)
+        if history is None:
+            # Первое обращение к чату: загружаем историю из БД в deque,
+            # дальше горячий путь обслуживается из памяти
+            async with self._conn.execute(_SQL_GET_HIST, (chat_id, MAX_HISTORY)) as cursor:
+                results = await cursor.fetchall()
+
+            history = deque(
+                (
+                    {"role": role, "content": content, "username": username}
+                    for role, content, username in results
+                ),
+                maxlen=MAX_HISTORY
+            )
+            self._history[chat_id] = history
+
+        return list(history)[-limit:]
+
+    async def build_messages(self, chat_id, system_prompt, user_turn):
+        """Собирает список сообщений для запроса к модели за один проход"""
+        history = self._history.get(chat_id)
+        if history is None:
+            await self.get_message_history(chat_id)
+            history = self._history.get(chat_id) or ()
+
+        # Предвыделенный список: без промежуточного копирования истории.
+        # Имя автора подставляется в содержимое только здесь
+        out = [None] * (len(history) + 2)
+        out[0] = {"role": "system", "content": system_prompt}
+
+        for i, entry in enumerate(history, start=1):
+            username = entry.get("username")
+            if username:
+                content = f"{username}: {entry['content']}"
+            else:
+                content = entry["content"]
+            out[i] = {"role": entry["role"], "content": content}
+
+        out[-1] = {"role": "user", "content": user_turn}
+        return out
+
+    def queue_messages(self, chat_id, rows):
+        """Ставит сообщения (role, content, username) в очередь на запись.
+
+        Кэш истории в памяти обновляется сразу — следующий запрос чата
+        строит промпт уже с этими репликами; вставка в SQLite уходит
+        фоновому писателю и не задерживает ответ пользователю.
+        """
+        now = int(time.time() * 1000)
+
+        history = self._history.setdefault(chat_id, deque(maxlen=MAX_HISTORY))
+        for role, content, username in rows:
+            history.append({"role": role, "content": content, "username": username})
+
+        # now + i сохраняет порядок строк при одинаковой метке времени
+        for i, (role, content, username) in enumerate(rows):
+            self._write_queue.put_nowait((chat_id, role, content, username, now + i))
+
+    async def _writer_loop(self):
+        """Фоновый писатель: коммитит накопленные вставки одной транзакцией"""
+        loop = asyncio.get_running_loop()
+        done = False
+
+        while not done:
+            # Ждём первую строку, затем добираем пришедшие в окно накопления
+            params = [await self._write_queue.get()]
+            if params[0] is None:
+                return
+
+            deadline = loop.time() + _WRITE_FLUSH_MS / 1000
+            while len(params) < _WRITE_MAX_BATCH:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._write_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    done = True
+                    break
+                params.append(item)
+
+            # Один fsync на пачку; ошибка записи не должна уронить писателя
+            try:
+                await self._conn.execute('BEGIN')
+                try:
+                    await self._conn.executemany(_SQL_ADD_MSG, params)
+                    await self._conn.execute('COMMIT')
+                except Exception:
+                    await self._conn.execute('ROLLBACK')
+                    raise
+            except Exception as e:
+                logger.error(f"Ошибка фоновой записи истории: {e}")
+
+    async def count_messages(self, chat_id):
+        """Возвращает количество сообщений в истории чата"""
+        history = self._history.get(chat_id)
+        if history is not None:
+            return len(history)
+
+        # Покрывается индексом idx_msg_chat_time: строки не материализуются
+        async with self._conn.execute(_SQL_COUNT_MSGS, (chat_id,)) as cursor:
+            row = await cursor.fetchone()
+
+        return row[0]
+
+    async def clear_chat_history(self, chat_id):
+        """Очищает историю сообщений для чата"""
+        self._settings_cache.pop(chat_id, None)
+        self._history.pop(chat_id, None)
+        await self._conn.execute(_SQL_CLEAR_HIST, (chat_id,))
+
+    async def prune_old_messages(self, days=30):
+        """Удаляет сообщения старше указанного количества дней"""
+        cutoff = int((time.time() - days * 86400) * 1000)
+
+        cursor = await self._conn.execute(_SQL_PRUNE, (cutoff,))
+        deleted_count = cursor.rowcount
+
+        return deleted_count
+
+    async def get_status_stats(self):
+        """Собирает статистику для периодического лога состояния"""
+        # Оба счётчика одним запросом: меньше обращений к фоновому
+        # потоку aiosqlite
+        async with self._conn.execute('''
+        SELECT
+            (SELECT COUNT(DISTINCT chat_id) FROM chat_settings),
+            (SELECT COUNT(*) FROM message_history)
+        ''') as cursor:
+            total_chats, total_messages = await cursor.fetchone()
+
+        async with self._conn.execute('SELECT chat_id, model FROM chat_settings') as cursor:
+            chat_models = await cursor.fetchall()
+
+        return total_chats, total_messages, chat_models
+
+    async def optimize(self):
+        """Обновляет статистику планировщика запросов SQLite"""
+        await self._conn.execute('PRAGMA optimize')
+
+    async def incremental_vacuum(self, pages=1000):
+        """Возвращает ОС до указанного числа освобождённых страниц БД"""
+        await self._conn.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+
+
+# Настройка логирования с ротацией файлов
+log_handler = RotatingFileHandler(
+    'bot.log',
+    maxBytes=10*1024*1024,  # 10 MB
+    backupCount=5,  # Хранить 5 архивных файлов
+    encoding='utf-8'
+)
+
+# Запись в файл и консоль идёт в фоновом потоке через очередь:
+# вызовы logger.* в обработчиках только кладут запись в очередь
+# и не блокируют event loop на время write() или ротации файла
+_log_queue = queue.SimpleQueue()
+
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+log_handler.setFormatter(_log_formatter)
+
+_console_handler = logging.StreamHandler()  # Вывод в консоль
+_console_handler.setFormatter(_log_formatter)
+
+logging.basicConfig(
+    level=logging.INFO,
+    handlers=[QueueHandler(_log_queue)]
+)
+
+_log_listener = QueueListener(
+    _log_queue,
+    log_handler,
+    _console_handler,
+    respect_handler_level=True
+)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logger = logging.getLogger(__name__)
+
+# Загрузка переменных из .env
+load_dotenv()
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
+
+# Дополнительные ключи через запятую: лимиты TPM/RPM считаются на ключ,
+# поэтому несколько ключей дают кратный запас пропускной способности
+GROQ_API_KEYS = [key.strip() for key in os.getenv("GROQ_API_KEYS", "").split(",") if key.strip()]
+if GROQ_API_KEY and GROQ_API_KEY not in GROQ_API_KEYS:
+    GROQ_API_KEYS.append(GROQ_API_KEY)
+
+# Проверка, что ключи загружены
+if not GROQ_API_KEYS or not TELEGRAM_TOKEN:
+    logger.error("Не удалось загрузить GROQ_API_KEY или TELEGRAM_TOKEN из .env")
+    raise ValueError("Необходимо указать GROQ_API_KEY и TELEGRAM_TOKEN в файле .env")
+
+# Общий пул HTTP-соединений для Groq: keep-alive избавляет каждый запрос
+# от TCP+TLS-рукопожатия, а HTTP/2 мультиплексирует параллельные запросы
+# в одном соединении
+_groq_http = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=64,
+        max_keepalive_connections=32,
+        keepalive_expiry=60
+    ),
+    timeout=60
+)
+
+# Пул клиентов Groq: по клиенту на ключ, все поверх общего пула
+# HTTP-соединений; асинхронные клиенты не блокируют event loop
+# на время генерации, поэтому чаты обрабатываются параллельно
+client_pool = GroqClientPool(GROQ_API_KEYS, http_client=_groq_http)
+
+# Коалесцирующий слой перед Groq: всплески одновременных запросов
+# группируются и отправляются волнами под семафором
+batcher = GroqBatcher(client_pool)
+
+# Токен-бакеты по моделям: перед запросом ждём локально, пока бюджет
+# TPM не позволит его отправить, вместо реакции на 429 от API
+_token_buckets = {}
+
+
+def _get_token_bucket(model):
+    bucket = _token_buckets.get(model)
+    if bucket is None:
+        bucket = _token_buckets[model] = GroqTokenBucket(MODEL_TPM.get(model, DEFAULT_TPM))
+    return bucket
+
+# Инициализация базы данных
+db = DatabaseManager()
+
+MAX_HISTORY = 50  # Максимальное количество сообщений в истории
+
+# Скомпилированный один раз шаблон для вырезания тегов <think>
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+
+# Системный промпт по умолчанию
+DEFAULT_SYSTEM_PROMPT = """Ты - полезный и дружелюбный ассистент в групповом чате Telegram.
+Твоя задача - помогать участникам чата, отвечать на их вопросы и поддерживать беседу.
+Старайся давать краткие, но информативные ответы.
+Помни, что тебя упоминают по имени, поэтому в ответах не надо обращаться к конкретному пользователю.
+Отвечай на русском языке, если не просят иное.
+Не используй эмодзи слишком часто.
+"""
+
+
+async def cleanup_old_data(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая очистка старых данных"""
+    # Очистка старых сообщений (старше 30 дней): DELETE идёт по индексу
+    # idx_msg_chat_time по целочисленной метке времени
+    deleted_count = await db.prune_old_messages(days=30)
+    await db.optimize()
+    logger.info(f"Очищено {deleted_count} старых сообщений из базы данных")
+
+
+async def vacuum_db(context: ContextTypes.DEFAULT_TYPE):
+    """Периодический возврат освобождённых страниц файла БД"""
+    await db.incremental_vacuum()
+    logger.info("Выполнен incremental_vacuum базы данных")
+
+
+def process_model_response(text):
+    """Обрабатывает ответ модели, удаляя теги <think> и их содержимое"""
+    # Быстрый путь: большинство моделей теги <think> не генерируют вовсе
+    if '<think>' not in text:
+        return text
+    return _THINK_RE.sub('', text).strip()
+
+
+# Кэш идентичных запросов: повторный вопрос при том же контексте и тех же
+# параметрах генерации не тратит ни сетевого round-trip, ни бюджета TPM
+_RESPONSE_CACHE_MAX = 1024
+_RESPONSE_CACHE_TTL = 3600
+_response_cache = OrderedDict()  # ключ -> (момент записи, текст ответа)
+_response_locks = {}  # ключ -> asyncio.Lock для коалесинга дублей
+
+# Классификатор текста ошибок Groq: один проход компилированного
+# регэкспа вместо нескольких .lower() и поисков подстрок
+_ERR_RE = re.compile(
+    r"(?P<rate>rate limit|quota)|(?P<decom>model.*decommissioned)",
+    re.IGNORECASE
+)
+
+# Блокировки по чатам: всплеск сообщений в одном чате обрабатывается
+# последовательно, порядок реплик в истории сохраняется, а суммарный
+# расход TPM не множится. Разные чаты друг друга не ждут
+CHAT_LOCKS = defaultdict(asyncio.Lock)
+
+
+def _response_cache_key(settings, messages):
+    """Ключ кэша: хэш параметров генерации и всех сообщений запроса"""
+    hasher = hashlib.sha1()
+    hasher.update(
+        f"{settings['model']}|{settings['temperature']}|{settings['max_tokens']}".encode()
+    )
+    for message in messages:
+        hasher.update(b"|")
+        hasher.update(message["content"].encode())
+    return hasher.hexdigest()
+
+
+def _response_cache_get(key):
+    """Возвращает кэшированный ответ или None, если его нет/он устарел"""
+    entry = _response_cache.get(key)
+    if entry is None:
+        return None
+
+    ts, reply = entry
+    if time.time() - ts > _RESPONSE_CACHE_TTL:
+        del _response_cache[key]
+        return None
+
+    _response_cache.move_to_end(key)
+    return reply
+
+
+def _response_cache_put(key, reply):
+    """Кладёт ответ в кэш, вытесняя самую старую запись"""
+    _response_cache[key] = (time.time(), reply)
+    _response_cache.move_to_end(key)
+    if len(_response_cache) > _RESPONSE_CACHE_MAX:
+        _response_cache.popitem(last=False)
+
+
+# Число попыток запроса к Groq при временных ошибках
+_GROQ_MAX_RETRIES = 3
+
+
+def _groq_retry_delay(e, attempt):
+    """Пауза перед повтором: retry-after из ответа или экспоненциальный рост"""
+    retry_after = None
+    response = getattr(e, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+
+    try:
+        delay = float(retry_after)
+    except (TypeError, ValueError):
+        delay = float(2 ** attempt)
+
+    # Джиттер разводит повторы одновременно затронутых чатов по времени
+    return delay + random.uniform(0, 0.5)
+
+
+async def groq_with_retry(**payload):
+    """Запрос к Groq с повторами при троттлинге и ошибках сервера.
+
+    Временный 429/5xx поглощается внутри процесса с паузой по retry-after
+    (или экспоненциальным backoff с джиттером) вместо немедленной ошибки
+    пользователю. Прочие ошибки, включая decommissioned-модель,
+    пробрасываются сразу.
+    """
+    for attempt in range(_GROQ_MAX_RETRIES):
+        try:
+            return await batcher.submit(**payload)
+        except (RateLimitError, InternalServerError, APIConnectionError) as e:
+            if attempt == _GROQ_MAX_RETRIES - 1:
+                raise
+            delay = _groq_retry_delay(e, attempt)
+            logger.warning(f"Временная ошибка Groq ({e}), повтор через {delay:.1f} с")
+            await asyncio.sleep(delay)
+
+
+# Параметры стриминга ответа: черновик в Telegram обновляется не чаще
+# чем раз в _STREAM_EDIT_INTERVAL секунд и не раньше, чем накопится
+# _STREAM_EDIT_CHARS новых символов
+_STREAM_EDIT_INTERVAL = 0.4
+_STREAM_EDIT_CHARS = 500
+
+
+async def stream_groq_reply(update, settings, messages):
+    """Стримит ответ Groq, периодически обновляя черновик сообщения.
+
+    Возвращает (черновик-сообщение или None, полный текст ответа модели).
+    """
+    # Оценка бюджета запроса: промпт плюс максимальная длина ответа
+    bucket = _get_token_bucket(settings["model"])
+    await bucket.acquire(estimate_tokens(messages) + settings["max_tokens"])
+
+    stream = await groq_with_retry(
+        model=settings["model"],
+        messages=messages,
+        max_tokens=settings["max_tokens"],
+        temperature=settings["temperature"],
+        stream=True
+    )
+
+    placeholder = None
+    parts = []
+    total_len = 0
+    sent_len = 0
+    last_edit = 0.0
+
+    try:
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content
+            if not delta:
+                continue
+
+            parts.append(delta)
+            total_len += len(delta)
+
+            now = time.time()
+            if total_len - sent_len < _STREAM_EDIT_CHARS or now - last_edit < _STREAM_EDIT_INTERVAL:
+                continue
+
+            # Показываем промежуточный текст без тегов <think> и без
+            # форматирования: Markdown может быть ещё не закрыт
+            preview = process_model_response(''.join(parts))
+            if not preview:
+                continue
+
+            try:
+                if placeholder is None:
+                    placeholder = await update.message.reply_text(preview[:4000])
+                else:
+                    await placeholder.edit_text(preview[:4000])
+                sent_len = total_len
+                last_edit = now
+            except Exception as e:
+                logger.warning(f"Не удалось обновить черновик ответа: {e}")
+    except Exception as e:
+        # Стрим оборвался на середине: повторяем запрос без стриминга,
+        # чтобы пользователь всё же получил полный ответ
+        logger.warning(f"Стрим Groq прервался ({e}), повтор без стриминга")
+        response = await groq_with_retry(
+            model=settings["model"],
+            messages=messages,
+            max_tokens=settings["max_tokens"],
+            temperature=settings["temperature"]
+        )
+        return placeholder, response.choices[0].message.content
+
+    return placeholder, ''.join(parts)
+
+
+async def send_long_message(update, text, parse_mode=None):
+    """Разбивает длинное сообщение на части с учетом целостности параграфов"""
+    MAX_LENGTH = 4000  # Чуть меньше лимита Telegram для безопасности
+
+    async def send_part(part):
+        try:
+            return await update.message.reply_text(part, parse_mode=parse_mode)
+        except Exception as e:
+            logger.error(f"Ошибка при отправке части сообщения: {e}")
+            # Пробуем отправить без форматирования
+            return await update.message.reply_text(part)
+
+    if len(text) <= MAX_LENGTH:
+        return await send_part(text)
+
+    # Разбиваем по абзацам для более естественного деления; куски
+    # накапливаются в списке и склеиваются одним ''.join при отправке,
+    # без квадратичной конкатенации строк
+    buf = []
+    buf_len = 0
+
+    for paragraph in text.split('\n\n'):
+        plen = len(paragraph) + 2
+
+        # Если добавление абзаца превысит лимит, отправляем текущую часть
+        if buf_len + plen > MAX_LENGTH:
+            if buf:
+                await send_part(''.join(buf))
+                buf = []
+                buf_len = 0
+
+            if plen > MAX_LENGTH:
+                # Если один абзац слишком большой, разбиваем его на части
+                for i in range(0, len(paragraph), MAX_LENGTH):
+                    await send_part(paragraph[i:i + MAX_LENGTH])
+                continue
+
+        buf.append(paragraph)
+        buf.append('\n\n')
+        buf_len += plen
+
+    # Отправляем оставшуюся часть, если она есть
+    if buf:
+        await send_part(''.join(buf))
+
+
+# Кэш администраторов чатов: chat_id -> (множество id, момент устаревания).
+# get_chat_administrators - полный сетевой запрос к Telegram API,
+# поэтому результат переиспользуется в течение _ADMIN_TTL секунд
+_admin_cache: dict = {}
+_ADMIN_TTL = 300
+
+# Упоминание бота в нижнем регистре ("@имя_бота"); вычисляется лениво
+# при первом сообщении, так как имя бота неизвестно на этапе импорта
+_BOT_MENTION = None
+
+
+async def is_admin(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
+    """Проверяет, является ли пользователь администратором группы"""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+
+    now = time.time()
+    cached = _admin_cache.get(chat_id)
+    if cached is not None and now < cached[1]:
+        return user_id in cached[0]
+
+    try:
+        # Получаем информацию о пользователях с правами администратора в чате
+        chat_admins = await context.bot.get_chat_administrators(chat_id)
+        admin_ids = frozenset(admin.user.id for admin in chat_admins)
+        _admin_cache[chat_id] = (admin_ids, now + _ADMIN_TTL)
+
+        # Проверяем, есть ли ID пользователя в множестве ID администраторов
+        is_user_admin = user_id in admin_ids
+
+        logger.info(f"Проверка прав администратора для пользователя {user_id} в чате {chat_id}: {is_user_admin}")
+        return is_user_admin
+    except Exception as e:
+        logger.error(f"Ошибка при проверке прав администратора: {str(e)}")
+        # В случае ошибки считаем, что пользователь не администратор
+        return False
+
+
+async def admin_required(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отправляет сообщение о необходимости прав администратора"""
+    await update.message.reply_text(
+        "⚠️ Для использования этой команды необходимы права администратора группы."
+    )
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /start"""
+    await update.message.reply_text(
+        f"Привет! Я бот на базе Groq API. Я буду отвечать на сообщения, в которых меня упоминают через @{context.bot.username}.\n"
+        "Используйте /help для получения списка команд и /models для информации о доступных моделях."
+    )
+
+
+# Пререндеренные тексты команд: большие строки /help, /models и /explain
+# не зависят от чата (кроме значений настроек), поэтому собираются один раз
+# в post_init, когда становится известно имя бота
+_HELP_BASIC = None
+_MODELS_REPORT = None
+_EXPLAIN_BASIC = None
+
+_HELP_ADMIN = (
+    "\n\n<b>Команды только для администраторов:</b>\n"
+    "/settings - Показать текущие настройки\n"
+    "/set_model [модель] - Установить модель (llama3-70b-8192, llama3-8b-8192 и др.)\n"
+    "/set_temp [0.0-1.0] - Установить температуру генерации\n"
+    "/set_max_tokens [число] - Установить максимальное количество токенов ответа\n"
+    "/toggle - Включить/выключить бота в этом чате\n"
+    "/clear_history - Очистить историю чата\n"
+)
+
+_EXPLAIN_RECOMMEND = (
+    "<b>🔍 Рекомендуемые настройки:</b>\n"
+    "• Для общего использования: llama3-70b-8192, температура 0.7\n"
+    "• Для точных ответов и фактов: llama3-70b-8192, температура 0.2\n"
+    "• Для креативных задач: llama3-70b-8192, температура 0.9\n"
+    "• Для быстрых ответов на простые вопросы: llama3-8b-8192, температура 0.5\n"
+)
+
+# Сообщение о лимите запросов: шаблон собирается один раз, в обработчике
+# ошибки подставляется только имя модели. Вариант без HTML-тегов готов
+# заранее — не нужно вырезать теги на лету при сбое форматирования
+_RATE_LIMIT_TEMPLATE = (
+    "⚠️ <b>Достигнут лимит запросов для модели</b> "
+    "<b>{model}</b>\n\n"
+    "Рекомендации:\n"
+    "1. Попробуйте использовать другую модель, например:\n"
+    "• /set_model deepseek-r1-distill-llama-70b (модель без дневного лимита токенов)\n"
+    "• /set_model llama3-8b-8192 (более легкая модель)\n\n"
+    "2. Подождите некоторое время - лимиты обновляются ежедневно\n\n"
+    "Используйте команду /models для просмотра всех доступных моделей и их лимитов."
+)
+
+_RATE_LIMIT_PLAIN = _RATE_LIMIT_TEMPLATE.replace("<b>", "").replace("</b>", "")
+
+
+def _render_static_texts(bot_username):
+    """Собирает статические тексты команд один раз при старте бота"""
+    global _HELP_BASIC, _MODELS_REPORT, _EXPLAIN_BASIC
+
+    _HELP_BASIC = (
+        "Доступные команды:\n"
+        "/start - Запустить бота\n"
+        "/help - Показать это сообщение\n"
+        "/explain - Руководство по использованию бота\n"
+        "/models - Информация о доступных моделях\n\n"
+        f"Вы можете обращаться к боту, упоминая его через @{bot_username} в сообщении"
+    )
+
+    report = "<b>Доступные модели:</b>\n\n"
+
+    for model_info in get_all_models_info():
+        model_name = model_info['name']
+
+        report += (
+            f"<b>{model_name}</b>\n"
+            f"• {model_info['description']}\n"
+            f"• <b>Когда использовать:</b> {model_info['use_case']}\n"
+            f"• <b>Особенности:</b> {model_info['features']}\n"
+            f"• <b>Лимиты:</b> {model_info['limits']}\n\n"
+        )
+
+    # Добавляем информацию о модели для распознавания голосовых сообщений
+    report += (
+        f"<b>Модель для голосовых сообщений: {WHISPER_MODEL}</b>\n"
+        f"• {WHISPER_MODEL_INFO['description']}\n"
+        f"• <b>Лимиты:</b> {WHISPER_MODEL_INFO['limits']}\n"
+        f"• <b>Особенности:</b> {WHISPER_MODEL_INFO['features']}\n\n"
+    )
+
+    report += "Для установки модели используйте команду /set_model [название_модели]"
+    _MODELS_REPORT = report
+
+    _EXPLAIN_BASIC = (
+        "📋 <b>Руководство по использованию бота</b>\n\n"
+
+        "<b>Как взаимодействовать с ботом:</b>\n"
+        f"• Упомянуть бота: @{bot_username} [ваш вопрос]\n"
+        "• Отправить голосовое сообщение, упомянув бота в подписи или ответив на его сообщение\n\n"
+
+        "<b>Примеры использования:</b>\n"
+        f"• @{bot_username} расскажи о квантовой физике\n"
+        f"• @{bot_username} реши задачу: 2x + 5 = 15\n"
+        f"• @{bot_username} напиши пример кода на Python для парсинга JSON\n\n"
+
+        "<b>Типы моделей:</b>\n"
+        "• Большие модели (llama3-70b-8192) - для сложных задач\n"
+        "• Средние модели (mistral-saba-24b) - универсальные\n"
+        "• Компактные модели (llama3-8b-8192, gemma-7b-it) - для простых запросов\n\n"
+
+        "Используйте команду /models для подробной информации о каждой модели"
+    )
+
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /help"""
+    is_user_admin = await is_admin(update, context)
+
+    # Если пользователь админ, показываем все команды
+    if is_user_admin:
+        await update.message.reply_text(_HELP_BASIC + _HELP_ADMIN, parse_mode="HTML")
+    else:
+        # Обычным пользователям показываем только базовые команды
+        await update.message.reply_text(_HELP_BASIC)
+
+
+async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показать текущие настройки чата"""
+    # Проверяем, является ли пользователь администратором
+    if not await is_admin(update, context):
+        await admin_required(update, context)
+        return
+
+    chat_id = update.effective_chat.id
+    settings = await db.get_chat_settings(chat_id)
+
+    # Получаем информацию о модели
+    model_info = get_model_info(settings['model'])
+
+    history_count = await db.count_messages(chat_id)
+
+    settings_text = (
+        f"<b>Текущие настройки:</b>\n"
+        f"• Модель: <b>{settings['model']}</b>\n"
+        f"• Температура: <b>{settings['temperature']}</b>\n"
+        f"• Максимальная длина ответа: <b>{settings['max_tokens']} токенов</b>\n"
+        f"• Бот: <b>{'активен' if settings['active'] else 'неактивен'}</b>\n"
+        f"• Количество сообщений в истории: <b>{history_count}/{MAX_HISTORY}</b>\n\n"
+        f"<b>Информация о текущей модели:</b>\n"
+        f"• {model_info['description']}\n"
+        f"• Рекомендуется для: {model_info['use_case']}\n"
+        f"• Лимиты: {model_info['limits']}\n"
+    )
+
+    await update.message.reply_text(settings_text, parse_mode="HTML")
+
+
+async def set_max_tokens(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Установить максимальное количество токенов ответа"""
+    # Проверяем, является ли пользователь администратором
+    if not await is_admin(update, context):
+        await admin_required(update, context)
+        return
+
+    chat_id = update.effective_chat.id
+
+    if not context.args:
+        await update.message.reply_text("Пожалуйста, укажите максимальное количество токенов (например, 2000)")
+        return
+
+    try:
+        max_tokens = int(context.args[0])
+        if max_tokens > 0:
+            settings = await db.get_chat_settings(chat_id)
+            settings["max_tokens"] = max_tokens
+            await db.save_chat_settings(chat_id, settings)
+            await update.message.reply_text(
+                f"Максимальное количество токенов установлено: <b>{max_tokens}</b>\n\n"
+                f"Это влияет на максимальную длину ответа бота. Чем больше значение, тем длиннее ответы может давать бот.",
+                parse_mode="HTML"
+            )
+        else:
+            await update.message.reply_text("Количество токенов должно быть положительным числом")
+    except ValueError:
+        await update.message.reply_text("Пожалуйста, укажите корректное целое число")
+
+
+async def set_model(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Установить модель для использования"""
+    # Проверяем, является ли пользователь администратором
+    if not await is_admin(update, context):
+        await admin_required(update, context)
+        return
+
+    chat_id = update.effective_chat.id
+
+    if not context.args:
+        await update.message.reply_text(
+            f"Пожалуйста, укажите модель. Например: /set_model llama3-70b-8192\n"
+            f"Для просмотра доступных моделей используйте /models"
+        )
+        return
+
+    model = context.args[0]
+
+    if model not in AVAILABLE_MODELS:
+        await update.message.reply_text(
+            f"Недопустимая модель. Доступные модели: {', '.join(AVAILABLE_MODELS)}\n"
+            f"Для подробной информации используйте /models"
+        )
+        return
+
+    # Получаем информацию о модели
+    model_info = get_model_info(model)
+
+    # Устанавливаем модель
+    settings = await db.get_chat_settings(chat_id)
+    settings["model"] = model
+    await db.save_chat_settings(chat_id, settings)
+
+    await update.message.reply_text(
+        f"✅ Модель установлена: <b>{model}</b>\n\n"
+        f"<b>Информация о модели:</b>\n"
+        f"• {model_info['description']}\n"
+        f"• Рекомендуется для: {model_info['use_case']}\n"
+        f"• Лимиты: {model_info['limits']}\n"
+        f"• Особенности: {model_info['features']}",
+        parse_mode="HTML"
+    )
+
+
+async def set_temperature(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Установить температуру генерации"""
+    # Проверяем, является ли пользователь администратором
+    if not await is_admin(update, context):
+        await admin_required(update, context)
+        return
+
+    chat_id = update.effective_chat.id
+
+    if not context.args:
+        await update.message.reply_text("Пожалуйста, укажите температуру (от 0.0 до 1.0)")
+        return
+
+    try:
+        temp = float(context.args[0])
+        if 0.0 <= temp <= 1.0:
+            settings = await db.get_chat_settings(chat_id)
+            settings["temperature"] = temp
+            await db.save_chat_settings(chat_id, settings)
+            await update.message.reply_text(
+                f"Температура установлена: <b>{temp}</b>\n\n"
+                f"<b>Что это значит:</b>\n"
+                f"• <b>Низкая (0.1-0.3)</b>: более предсказуемые, точные ответы. Хорошо для фактических вопросов и кодирования.\n"
+                f"• <b>Средняя (0.4-0.7)</b>: баланс между точностью и разнообразием. Подходит для большинства задач.\n"
+                f"• <b>Высокая (0.8-1.0)</b>: более креативные, разнообразные ответы. Подходит для творческих задач.",
+                parse_mode="HTML"
+            )
+        else:
+            await update.message.reply_text("Температура должна быть от 0.0 до 1.0")
+    except ValueError:
+        await update.message.reply_text("Пожалуйста, укажите корректное число")
+
+
+async def toggle_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Включить/выключить бота в чате"""
+    # Проверяем, является ли пользователь администратором
+    if not await is_admin(update, context):
+        await admin_required(update, context)
+        return
+
+    chat_id = update.effective_chat.id
+    settings = await db.get_chat_settings(chat_id)
+    settings["active"] = not settings["active"]
+    await db.save_chat_settings(chat_id, settings)
+    status = "активен" if settings["active"] else "неактивен"
+    await update.message.reply_text(f"Бот теперь {status} в этом чате")
+
+
+async def clear_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Очистить историю чата"""
+    # Проверяем, является ли пользователь администратором
+    if not await is_admin(update, context):
+        await admin_required(update, context)
+        return
+
+    chat_id = update.effective_chat.id
+    await db.clear_chat_history(chat_id)
+    await update.message.reply_text("История чата очищена")
+
+
+async def models_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показать информацию о доступных моделях"""
+    try:
+        await update.message.reply_text(_MODELS_REPORT, parse_mode="HTML")
+    except Exception as e:
+        # В случае ошибки форматирования отправляем без HTML
+        logger.error(f"Ошибка при отправке информации о моделях: {str(e)}")
+        await update.message.reply_text(_MODELS_REPORT.replace("<b>", "").replace("</b>", ""))
+
+
+async def explain_settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
+
+    """Объяснить все параметры настройки бота"""
+    chat_id = update.effective_chat.id
+    settings = await db.get_chat_settings(chat_id)
+    is_user_admin = await is_admin(update, context)
+    history_count = await db.count_messages(chat_id)
+
+    # Информация по настройкам только для администраторов
+    admin_explanation = ""
+    if is_user_admin:
+        admin_explanation = (
+            "\n\n<b>Настройка бота (только для администраторов):</b>\n"
+
+            "<b>Модель ИИ</b>\n"
+            "Команда: /set_model [модель]\n"
+            f"Текущая модель: <b>{settings['model']}</b>\n\n"
+
+            "<b>Температура</b>\n"
+            "Команда: /set_temp [значение от 0.0 до 1.0]\n"
+            "• <b>Низкая (0.1-0.3)</b>: более предсказуемые, точные ответы. Хорошо для фактических вопросов и кодирования.\n"
+            "• <b>Средняя (0.4-0.7)</b>: баланс между точностью и разнообразием. Подходит для большинства задач.\n"
+            "• <b>Высокая (0.8-1.0)</b>: более случайные, творческие ответы. Подходит для креативных задач, генерации идей.\n"
+            f"Текущая температура: <b>{settings['temperature']}</b>\n\n"
+            
+            "<b>Максимальное количество токенов</b>\n"
+            "Команда: /set_max_tokens [число]\n"
+            "• Определяет максимальную длину ответа бота\n"
+            "• Чем выше значение, тем длиннее может быть ответ\n"
+            "• Рекомендуемые значения: 1000-4000\n"
+            f"Текущее значение: <b>{settings['max_tokens']}</b>\n\n"
+            
+            "<b>История сообщений</b>\n"
+            "Команда для очистки: /clear_history\n"
+            "• Бот запоминает историю диалога, что позволяет давать более контекстные ответы.\n"
+            "• Очистка истории полезна при смене темы или для экономии токенов.\n"
+            f"Текущее количество сообщений в истории: <b>{history_count}/{MAX_HISTORY}</b>\n\n"
+
+            "<b>Активация/деактивация</b>\n"
+            "Команда: /toggle\n"
+            "• Включает или выключает бота в данном чате.\n"
+            f"Текущий статус: <b>{'Активен' if settings['active'] else 'Неактивен'}</b>\n\n"
+        ) + _EXPLAIN_RECOMMEND
+
+    explanation = _EXPLAIN_BASIC + admin_explanation
+
+    try:
+        await update.message.reply_text(explanation, parse_mode="HTML")
+        logger.info(f"Отправлено руководство по настройкам в чат {chat_id}")
+    except Exception as e:
+        logger.error(f"Ошибка при отправке руководства: {str(e)}")
+        # Запасной вариант без HTML-форматирования
+        plain_explanation = explanation.replace("<b>", "").replace("</b>", "")
+        await update.message.reply_text(plain_explanation)
+        logger.info(f"Отправлена версия руководства без форматирования в чат {chat_id}")
+
+
+async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка входящих сообщений"""
+    if update.message.chat.type in ["group", "supergroup"]:
+        chat_id = update.message.chat.id
+        username = update.message.from_user.username or update.message.from_user.first_name or "Unknown"
+
+        # Проверяем, активен ли бот в этом чате
+        settings = await db.get_chat_settings(chat_id)
+        if not settings["active"]:
+            logger.info(f"Бот неактивен в чате {chat_id}, игнорирую сообщение")
+            return
+
+        # Обработка голосовых сообщений
+        if update.message.voice:
+            logger.info(f"Получено голосовое сообщение от @{username} в чате {chat_id}")
+
+            # Получаем транскрипцию голосового сообщения
+            transcribed_text = await process_voice_message(update, context, client_pool.acquire())
+
+            # Если не удалось получить текст, прекращаем обработку
+            if not transcribed_text:
+                logger.warning("Не удалось получить текст голосового сообщения")
+                return
+
+            # Устанавливаем транскрибированный текст как сообщение для обработки
+            user_message = transcribed_text
+            logger.info(f"Транскрипция голосового сообщения: {user_message}")
+        else:
+            # Обработка текстовых сообщений
+            user_message = update.message.text
+
+            global _BOT_MENTION
+            if _BOT_MENTION is None:
+                _BOT_MENTION = f"@{context.bot.username}".lower()
+
+            # Быстрый путь: если упоминания нет и это не ответ на сообщение
+            # бота, выходим по одному поиску подстроки, не трогая entities
+            low_message = user_message.lower()
+            is_reply_to_bot = bool(
+                update.message.reply_to_message
+                and update.message.reply_to_message.from_user.id == context.bot.id
+            )
+
+            if _BOT_MENTION not in low_message and not is_reply_to_bot:
+                logger.info(f"Бот не упомянут в сообщении, игнорирую")
+                return
+
+            if _BOT_MENTION in low_message:
+                # Вырезаем упоминание одним проходом, сохраняя регистр
+                # остального текста
+                idx = low_message.find(_BOT_MENTION)
+                clean_message = (
+                    user_message[:idx] + user_message[idx + len(_BOT_MENTION):]
+                ).strip()
+                logger.info(f"Найдено упоминание бота, сообщение после очистки: {clean_message}")
+            else:
+                clean_message = user_message
+                logger.info(f"Сообщение является ответом на сообщение бота")
+
+            # Если после удаления упоминания сообщение пустое
+            if not clean_message:
+                logger.info("Сообщение содержит только упоминание бота, отправляю приветствие")
+                await update.message.reply_text("Здравствуйте! Чем я могу вам помочь?")
+                return
+
+            user_message = clean_message
+
+        logger.info(f"Обрабатываю сообщение от @{username} в чате {chat_id}: {user_message}")
+
+        try:
+            # Запросы одного чата сериализуются: ответы приходят в порядке
+            # вопросов, а история строится уже с учётом предыдущего ответа,
+            # при этом разные чаты обрабатываются параллельно
+            async with CHAT_LOCKS[chat_id]:
+                user_turn = f"{username}: {user_message}"
+                messages = await db.build_messages(chat_id, settings["system_prompt"], user_turn)
+
+                # Обрезаем историю под бюджет токенов: расход TPM на запрос
+                # становится предсказуемым, а старый контекст не тратит бюджет
+                messages = budget_trim(messages, max(4096, 16000 - settings["max_tokens"]))
+
+                # Логируем детали запроса для отладки
+                logger.info(f"Модель: {settings['model']}")
+                logger.info(f"Температура: {settings['temperature']}")
+                logger.info(f"Макс. токенов: {settings['max_tokens']}")
+                logger.info(f"Кол-во сообщений в истории: {len(messages) - 2}")
+
+                # Отправляем индикатор набора текста
+                await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+
+                # Идентичный запрос обслуживается из кэша; блокировка по ключу
+                # коалесцирует одновременные дубли в один вызов Groq
+                cache_key = _response_cache_key(settings, messages)
+                lock = _response_locks.setdefault(cache_key, asyncio.Lock())
+
+                async with lock:
+                    reply_text = _response_cache_get(cache_key)
+                    if reply_text is not None:
+                        placeholder = None
+                        logger.info("Ответ взят из кэша, запрос к Groq пропущен")
+                    else:
+                        # Запрос к Groq со стримингом: пользователь видит черновик
+                        # ответа по мере генерации
+                        logger.info("Отправка запроса к API Groq...")
+                        start_time = time.time()
+                        placeholder, reply_text = await stream_groq_reply(update, settings, messages)
+                        elapsed_time = time.time() - start_time
+                        logger.info(f"Ответ от Groq получен за {elapsed_time:.2f} секунд")
+                        _response_cache_put(cache_key, reply_text)
+
+                if not lock.locked():
+                    _response_locks.pop(cache_key, None)
+
+                # Ставим реплики в очередь фоновой записи: кэш истории
+                # обновляется сразу, коммит в SQLite не задерживает ответ
+                db.queue_messages(chat_id, [
+                    ("user", user_message, username),
+                    ("assistant", reply_text, None)
+                ])
+
+                # Логируем успешный ответ
+                logger.info(f"Отправлен ответ в чат {chat_id}: {reply_text[:50]}...")
+
+                # Очищаем ответ от тегов <think>
+                cleaned_reply = process_model_response(reply_text)
+
+                # Заменяем черновик финальным текстом; слишком длинный ответ
+                # разбиваем на части
+                if placeholder is None:
+                    await send_long_message(update, cleaned_reply, parse_mode="Markdown")
+                elif len(cleaned_reply) <= 4000:
+                    try:
+                        await placeholder.edit_text(cleaned_reply, parse_mode="Markdown")
+                    except Exception as e:
+                        logger.error(f"Ошибка при финальном обновлении сообщения: {e}")
+                        try:
+                            await placeholder.edit_text(cleaned_reply)
+                        except Exception:
+                            pass
+                else:
+                    await placeholder.edit_text(cleaned_reply[:4000])
+                    await send_long_message(update, cleaned_reply[4000:], parse_mode="Markdown")
+
+        except Exception as e:
+            # Расширенное логирование ошибки
+            logger.error(f"Ошибка при обработке запроса в чате {chat_id}: {str(e)}")
+            logger.error(f"Тип ошибки: {type(e).__name__}")
+
+            # Классифицируем ошибку одним проходом регэкспа
+            error_match = _ERR_RE.search(str(e))
+
+            if error_match and error_match.group("decom"):
+                logger.error("Обнаружена ошибка с моделью! Возможно, модель устарела или не поддерживается.")
+                await update.message.reply_text(
+                    f"Модель {settings['model']} недоступна или устарела. "
+                    f"Переключаюсь на llama3-70b-8192."
+                )
+                settings['model'] = "llama3-70b-8192"
+            elif error_match and error_match.group("rate"):
+                logger.error("Достигнут лимит запросов API")
+
+                try:
+                    await update.message.reply_text(
+                        _RATE_LIMIT_TEMPLATE.format(model=settings['model']),
+                        parse_mode="HTML"
+                    )
+                except:
+                    # Если с HTML возникла проблема, отправляем без форматирования
+                    await update.message.reply_text(
+                        _RATE_LIMIT_PLAIN.format(model=settings['model'])
+                    )
+            else:
+                # Общее сообщение об ошибке
+                await update.message.reply_text(
+                    "Произошла ошибка, попробуйте позже или используйте другую модель (/models для просмотра доступных моделей).")
+
+
+# Функция для обработки голосовых сообщений
+async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработка голосовых сообщений"""
+    # Вызываем общий обработчик сообщений, который определит голосовое сообщение
+    await handle_message(update, context)
+
+
+# Функция для мониторинга состояния
+async def log_status(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическое логирование состояния бота"""
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    total_chats, total_messages, chat_models = await db.get_status_stats()
+
+    logger.info(f"=== СТАТУС БОТА [{now}] ===")
+    logger.info(f"Активных чатов: {total_chats}")
+    logger.info(f"Всего сообщений в БД: {total_messages}")
+    logger.info(f"Настройки чатов: {', '.join([f'Чат {cid}: {model}' for cid, model in chat_models])}")
+    logger.info("=== КОНЕЦ СТАТУСА ===")
+
+
+async def post_init(application: Application):
+    """Инициализация ресурсов после запуска event loop"""
+    await db.init()
+    batcher.start()
+    _render_static_texts(application.bot.username)
+    # Упоминание бота считается один раз на старте; обработчики берут
+    # готовую строку из bot_data вместо сборки на каждое сообщение
+    application.bot_data["mention"] = f"@{application.bot.username}"
+
+
+async def post_shutdown(application: Application):
+    """Освобождение ресурсов при остановке бота"""
+    await batcher.stop()
+    await db.close()
+    await _groq_http.aclose()
+
+
+# Запуск бота
+if __name__ == "__main__":
+    logger.info("=========================================")
+    logger.info("Запуск бота...")
+    logger.info(f"Время запуска: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info(f"Используемый API: Groq")
+    logger.info(f"Настройки логирования: уровень {logging.getLevelName(logger.level)}")
+    logger.info("=========================================")
+
+    app = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        # Пул keep-alive соединений и для Telegram Bot API
+        .request(HTTPXRequest(connection_pool_size=20))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
+
+    # Добавляем обработчики команд
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("help", help_command))
+    app.add_handler(CommandHandler("settings", settings))
+    app.add_handler(CommandHandler("set_model", set_model))
+    app.add_handler(CommandHandler("set_temp", set_temperature))
+    app.add_handler(CommandHandler("set_max_tokens", set_max_tokens))
+    app.add_handler(CommandHandler("toggle", toggle_bot))
+    app.add_handler(CommandHandler("clear_history", clear_history))
+    app.add_handler(CommandHandler("explain", explain_settings))
+    app.add_handler(CommandHandler("models", models_command))
+
+    # Обработчик для текстовых сообщений
+    app.add_handler(MessageHandler(
+        filters.TEXT & ~filters.COMMAND,
+        handle_message
+    ))
+
+    # Обработчик для голосовых сообщений
+    app.add_handler(MessageHandler(
+        filters.VOICE,
+        handle_voice
+    ))
+
+    # Добавляем периодическую задачу для логирования состояния
+    job_queue = app.job_queue
+    job_queue.run_repeating(log_status, interval=3600, first=10)  # Логирование каждый час
+    #Очистка базы данных
+    job_queue.run_daily(cleanup_old_data, time=datetime.time(hour=3, minute=0))  # Запуск ежедневно в 3:00
+    # Возврат освобождённых страниц БД раз в неделю
+    job_queue.run_repeating(vacuum_db, interval=7 * 24 * 3600, first=600)
+
+    logger.info("Бот готов к работе, начинаю прослушивание...")
+
+    # Запуск бота
+    app.run_polling()
+
+    logger.info("=========================================")
+    logger.info("Бот остановлен.")
+    logger.info(f"Время остановки: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info("=========================================")
\ No newline at end of file
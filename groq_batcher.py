@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+from groq import RateLimitError
+
+logger = logging.getLogger(__name__)
+
+# Окно накопления запросов и ограничения батча
+FLUSH_MS = 100
+MAX_BATCH = 8
+MAX_CONCURRENCY = 8
+
+
+class GroqBatcher:
+    """Коалесцирует параллельные запросы к Groq API.
+
+    Запросы, пришедшие в течение окна накопления (FLUSH_MS), группируются
+    по ключу (model, temperature, max_tokens) и отправляются одной волной
+    через asyncio.gather под семафором. Всплеск сообщений в занятом чате
+    порождает ограниченное число одновременных обращений к API вместо
+    неограниченного, одиночные запросы проходят без задержки по истечении
+    окна.
+    """
+
+    def __init__(self, pool, flush_ms=FLUSH_MS, max_batch=MAX_BATCH,
+                 max_concurrency=MAX_CONCURRENCY):
+        self._pool = pool
+        self._flush_interval = flush_ms / 1000
+        self._max_batch = max_batch
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self):
+        """Запускает фоновую задачу-воркер"""
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Останавливает воркер"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, **payload):
+        """Ставит запрос в очередь и ждёт результат chat.completions.create"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((payload, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # Ждём первый запрос, затем добираем пришедшие в окно накопления
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._flush_interval
+
+            while len(batch) < self._max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Группируем по параметрам генерации и отправляем волнами,
+            # не блокируя приём следующих запросов
+            groups = {}
+            for payload, future in batch:
+                key = (
+                    payload.get("model"),
+                    payload.get("temperature"),
+                    payload.get("max_tokens")
+                )
+                groups.setdefault(key, []).append((payload, future))
+
+            for items in groups.values():
+                loop.create_task(self._flush_group(items))
+
+    async def _flush_group(self, items):
+        """Отправляет одну группу запросов параллельно"""
+        await asyncio.gather(
+            *(self._dispatch(payload, future) for payload, future in items)
+        )
+
+    async def _dispatch(self, payload, future):
+        async with self._semaphore:
+            client = self._pool.acquire()
+            try:
+                result = await client.chat.completions.create(**payload)
+            except Exception as e:
+                if isinstance(e, RateLimitError):
+                    self._mark_rate_limited(client, e)
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    def _mark_rate_limited(self, client, e):
+        """Отправляет ключ в cooldown по retry-after из ответа 429"""
+        retry_after = None
+        response = getattr(e, "response", None)
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+
+        try:
+            delay = float(retry_after)
+        except (TypeError, ValueError):
+            delay = 10.0
+
+        self._pool.mark_rate_limited(client, delay)
@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+# Лимиты токенов в минуту (TPM) по моделям Groq; соответствуют лимитам
+# из model_info.py. Для неизвестных моделей берётся DEFAULT_TPM
+DEFAULT_TPM = 6000
+
+MODEL_TPM = {
+    "llama3-70b-8192": 6000,
+    "llama3-8b-8192": 15000,
+    "gemma2-9b-it": 15000,
+    "mistral-saba-24b": 6000,
+    "deepseek-r1-distill-llama-70b": 6000,
+}
+
+
+def _message_cost(message):
+    """Оценка числа токенов одного сообщения: ~4 символа на токен"""
+    return len(message.get("content") or "") // 4 + 4
+
+
+def estimate_tokens(messages):
+    """Грубая оценка числа токенов запроса"""
+    total = 0
+    for message in messages:
+        total += _message_cost(message)
+    return total
+
+
+def budget_trim(messages, budget):
+    """Обрезает историю под бюджет токенов.
+
+    Идёт от новых сообщений к старым и прекращает набор, когда бюджет
+    исчерпан. Системный промпт (первый элемент) и самое новое сообщение
+    (текущий вопрос) сохраняются всегда.
+    """
+    if not messages:
+        return messages
+
+    system = messages[0]
+    budget -= _message_cost(system)
+
+    kept = []
+    used = 0
+    for message in reversed(messages[1:]):
+        cost = _message_cost(message)
+        if kept and used + cost > budget:
+            break
+        kept.append(message)
+        used += cost
+
+    kept.reverse()
+    return [system] + kept
+
+
+class GroqTokenBucket:
+    """Проактивный token-bucket под TPM-лимит одной модели.
+
+    acquire() ждёт локально, пока в ведре наберётся оценка токенов
+    запроса, вместо того чтобы отправить запрос и получить 429 после
+    полного сетевого round-trip. Ведро пополняется линейно из расчёта
+    tpm токенов в минуту; заголовки x-ratelimit-* из ответа API, когда
+    они доступны, корректируют остаток.
+    """
+
+    def __init__(self, tpm=DEFAULT_TPM):
+        self._capacity = float(tpm)
+        self._tokens = float(tpm)
+        self._rate = tpm / 60.0
+        self._updated = time.monotonic()
+        self._condition = asyncio.Condition()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(
+            self._capacity,
+            self._tokens + (now - self._updated) * self._rate
+        )
+        self._updated = now
+
+    async def acquire(self, estimated_tokens):
+        """Ждёт, пока в ведре хватит токенов, и списывает их"""
+        # Запрос крупнее ёмкости ведра иначе ждал бы вечно
+        estimated_tokens = min(estimated_tokens, self._capacity)
+
+        async with self._condition:
+            while True:
+                self._refill()
+                if self._tokens >= estimated_tokens:
+                    self._tokens -= estimated_tokens
+                    return
+
+                wait = (estimated_tokens - self._tokens) / self._rate
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def update_from_headers(self, headers):
+        """Корректирует остаток по заголовкам x-ratelimit-* ответа API"""
+        if not headers:
+            return
+
+        remaining = headers.get("x-ratelimit-remaining-tokens")
+        if remaining is None:
+            return
+
+        try:
+            remaining = float(remaining)
+        except (TypeError, ValueError):
+            return
+
+        async with self._condition:
+            self._tokens = min(self._capacity, remaining)
+            self._updated = time.monotonic()
+            self._condition.notify_all()
@@ -0,0 +1,50 @@
+import time
+import logging
+
+from groq import AsyncGroq
+
+logger = logging.getLogger(__name__)
+
+
+class GroqClientPool:
+    """Пул клиентов Groq с отдельными API-ключами.
+
+    Лимиты TPM/RPM считаются на организацию, то есть на ключ, поэтому
+    N ключей дают кратный запас пропускной способности. acquire()
+    возвращает клиент, не использовавшийся дольше всех; ключ, получивший
+    429, уходит в cooldown до своего retry-after и до его истечения
+    выбирается только если готовых ключей нет.
+    """
+
+    def __init__(self, api_keys, http_client=None):
+        if not api_keys:
+            raise ValueError("Нужен хотя бы один API-ключ Groq")
+
+        # Пары [клиент, момент готовности]: метка времени последней выдачи
+        # либо конец cooldown после 429
+        self._clients = [
+            [AsyncGroq(api_key=key, http_client=http_client), 0.0]
+            for key in api_keys
+        ]
+
+    def __len__(self):
+        return len(self._clients)
+
+    def acquire(self):
+        """Возвращает клиент с наименьшим временем готовности"""
+        now = time.monotonic()
+        entry = min(self._clients, key=lambda item: item[1])
+
+        if entry[1] > now:
+            logger.warning("Все ключи Groq в cooldown, выбран ближайший к готовности")
+
+        # Свежая метка делает ключ последним кандидатом на следующий acquire
+        entry[1] = max(entry[1], now)
+        return entry[0]
+
+    def mark_rate_limited(self, client, delay):
+        """Отправляет ключ в cooldown на delay секунд после 429"""
+        for entry in self._clients:
+            if entry[0] is client:
+                entry[1] = time.monotonic() + delay
+                break